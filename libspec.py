@@ -2,11 +2,71 @@ import os
 import ctypes
 import sys
 import numpy as np
-from time import sleep
 import platform
+import time
+import threading
+import queue
+import collections
+import tempfile
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional, the NumPy path is used without it
+    njit = None
+
+CALIBRATION_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'asqespectrometer')
+CALIBRATION_CACHE_MAX_AGE = 30 * 24 * 3600  # in seconds (30 days)
+FLASH_CHUNK_SIZE = 32768  # max bytes per readFlash call
+FRAME_BUFFER_SIZE = 3694  # pixels per frame returned by getFrame
+
+# (first, last) line ranges of the wavelength, norm_coef and power_coef blocks in the calibration file
+CALIBRATION_BLOCKS = ((12, 3665), (3666, 7319), (7320, 10973))
+
+def _parse_float_blocks(calib, line_starts, blocks):
+    """
+    Parse the given line ranges of the raw calibration bytes, one float per line,
+    into a single packed array. Returns the array and the (start, stop) slice of each block.
+    """
+    slices = []
+    parts = []
+    offset = 0
+    for first, last in blocks:
+        if last >= len(line_starts):
+            raise ValueError("Calibration data is shorter than expected")
+        parts.append(calib[line_starts[first]:line_starts[last] - 1])
+        slices.append((offset, offset + last - first))
+        offset += last - first
+
+    data = np.fromstring(b'\n'.join(parts), sep='\n')
+    if data.size != offset:
+        raise ValueError("Failed to parse calibration arrays")
+    return data, slices
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _calibrate(raw, coef):
+        """
+        Fused background subtraction and calibration of a raw uint16 frame.
+        Same result as subtract_background() followed by the fp32 calibration multiply,
+        coef already includes the 1 / exposure_time factor.
+        """
+        hi = 0.0
+        for i in range(15, 31):
+            hi += raw[i]
+        lo = 0.0
+        for i in range(3686, 3692):
+            lo += raw[i]
+        background = np.float32(hi / 32 + lo / 12)
+
+        out = np.empty(coef.shape[0], dtype=np.float32)
+        for i in range(coef.shape[0]):
+            out[i] = (np.float32(raw[32 + i]) - background) * coef[i]
+        return out
+else:
+    _calibrate = None
 
 class ASQESpectrometer:
-    def __init__(self):
+    def __init__(self, serial=None):
         # Determine OS and load appropriate library
         if sys.platform == 'win32':
             # Get architecture
@@ -21,6 +81,7 @@ class ASQESpectrometer:
             lib_name = 'libspectr.so'
         lib_path = os.path.join(os.path.dirname(__file__), 'lib', lib_name)
         self.lib = ctypes.CDLL(lib_path)
+        self.serial = serial
 
         # Initialize device parameters
         self.num_of_scans = 1
@@ -31,12 +92,30 @@ class ASQESpectrometer:
         self.num_of_end_element = 3647
         self.reduction_mode = 0
 
+        self._num_pixels = ctypes.c_uint16(0)
+
+        # Frame buffer reused by every capture
+        self._frame_buf = (ctypes.c_uint16 * FRAME_BUFFER_SIZE)()
+        self._frame_view = np.frombuffer(self._frame_buf, dtype=np.uint16)
+        # Serializes driver calls, e.g. between stream_spectra() and the caller
+        self._device_lock = threading.RLock()
+        # Spare buffers for frames handed out by get_spectrum(), refilled by release_frame()
+        self._buf_pool = collections.deque(maxlen=4)
+
         # Initialize calibration variables
         self._calibration_data_loaded = False
         self.bck_aT = None
         self.wavelength = None
         self.norm_coef = None
         self.power_coef = None
+        self._inv_norm_coef = None
+        self._combined_coef = None
+        self._combined_coef_f32 = None
+        self._scaled_coef_f32 = None
+        self._scaled_exposure_time = None
+        self._calibration_file = None  # raw calibration file read from flash
+        self._calibration_file_terminated = False  # whether the 0xFFFF terminator was found
+        self._flash_buf = (ctypes.c_uint8 * FLASH_CHUNK_SIZE)()
 
         # Setup function prototypes
         self._setup_function_prototypes()
@@ -85,8 +164,15 @@ class ASQESpectrometer:
         ]
         self.lib.readFlash.restype = ctypes.c_int
 
+        # Bind hot-path functions once to skip the CDLL attribute lookup on every call
+        self._trigger = self.lib.triggerAcquisition
+        self._get_status = self.lib.getStatus
+        self._get_frame = self.lib.getFrame
+        self._read_flash = self.lib.readFlash
+
     def connect(self):
-        result = self.lib.connectToDevice(None)
+        serial = self.serial.encode() if self.serial is not None else None
+        result = self.lib.connectToDevice(serial)
         if result != 0:
             raise ConnectionError(f"Failed to connect to device. Error code: {result}")
 
@@ -94,29 +180,101 @@ class ASQESpectrometer:
         """
         Read bytes from the flash memory starting at the given offset.
         """
-        READ_FLASH_OK = 0
-        buffer = (ctypes.c_uint8 * size)()
-        result = self.lib.readFlash(buffer, offset, size)
-        if result != READ_FLASH_OK:
-            raise RuntimeError(f"readFlesh failed with code {result}")
-        return bytes(buffer)
+        with self._device_lock:
+            self._check_open()
+
+            # Reuse the preallocated buffer when it is large enough
+            buffer = self._flash_buf if size <= FLASH_CHUNK_SIZE else (ctypes.c_uint8 * size)()
+
+            READ_FLASH_OK = 0
+            result = self._read_flash(buffer, offset, size)
+            if result != READ_FLASH_OK:
+                raise RuntimeError(f"readFlesh failed with code {result}")
+            return ctypes.string_at(buffer, size)
     
     def read_calibration_file(self):
+        """
+        Read the calibration file from flash in FLASH_CHUNK_SIZE requests, up to the 0xFFFF terminator.
+        The file is read once and kept until invalidate_cache() is called.
+        """
+        if self._calibration_file is not None:
+            return bytearray(self._calibration_file)
+
         offset = 0
-        CHUNK_SIZE = 1000
-        MAX_SIZE = 100000
-        FOUND_TERMINATION = False
+        MAX_SIZE = 101000  # the original 1000-byte loop read up to offset 100000 inclusive
         full_data = bytearray()
-        while offset <= MAX_SIZE and not FOUND_TERMINATION:
-            data = self.read_flash(offset, CHUNK_SIZE)
-            stop_index = data.find(b"\xff\xff")
+        self._calibration_file_terminated = False
+        while offset < MAX_SIZE:
+            chunk = self.read_flash(offset, min(FLASH_CHUNK_SIZE, MAX_SIZE - offset))
+            # Start one byte back so a terminator straddling two chunks is found
+            start = max(0, len(full_data) - 1)
+            full_data.extend(chunk)
+            stop_index = full_data.find(b"\xff\xff", start)
             if stop_index != -1:
-                full_data.extend(data[:stop_index])
-                FOUND_TERMINATION = True
-            else:
-                full_data.extend(data)
-            offset += CHUNK_SIZE
+                del full_data[stop_index:]
+                self._calibration_file_terminated = True
+                break
+            offset += len(chunk)
+        self._calibration_file = bytes(full_data)
         return full_data
+
+    def _calibration_cache_path(self):
+        """Path of the on-disk calibration cache, or None if the device serial is unknown or unsafe as a file name."""
+        serial = self.serial
+        if serial is None or serial in ('', '.', '..') or '\0' in serial:
+            return None
+        if os.sep in serial or (os.altsep and os.altsep in serial):
+            return None
+        return os.path.join(CALIBRATION_CACHE_DIR, f"{serial}.cal")
+
+    def _load_cached_calibration(self):
+        path = self._calibration_cache_path()
+        if path is None or not os.path.isfile(path):
+            return None
+        if time.time() - os.path.getmtime(path) > CALIBRATION_CACHE_MAX_AGE:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _save_cached_calibration(self, calib):
+        path = self._calibration_cache_path()
+        if path is None:
+            return
+        tmp_path = None
+        try:
+            os.makedirs(CALIBRATION_CACHE_DIR, exist_ok=True)
+            # Write to a temporary file and rename it, so readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=CALIBRATION_CACHE_DIR, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(calib)
+            os.replace(tmp_path, path)
+        except OSError:
+            # The cache is only an optimization, reading from flash still works
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _remove_cached_calibration(self):
+        path = self._calibration_cache_path()
+        if path is None:
+            return
+        try:
+            os.remove(path)
+        except OSError:
+            # Missing or not removable, the cache is only an optimization
+            pass
+
+    def invalidate_cache(self):
+        """Drop cached flash data and calibration, forcing a re-read from the device."""
+        self._calibration_file = None
+        self._calibration_data_loaded = False
+        self._inv_norm_coef = None
+        self._combined_coef = None
+        self._combined_coef_f32 = None
+        self._scaled_coef_f32 = None
+        self._remove_cached_calibration()
     
     def load_calibration_data(self):
         """Return calibration data, reading from flash only once."""
@@ -124,22 +282,51 @@ class ASQESpectrometer:
         if self._calibration_data_loaded:
             return
         
-        # Read and parse flash data if not cached
-        calib = self.read_calibration_file()
-        decode_data = calib.decode("utf-8")
-        lines = decode_data.splitlines()
+        # Parse the disk cache if present, drop it if it turns out to be corrupt
+        calib = self._load_cached_calibration()
+        if calib is not None:
+            try:
+                self._parse_calibration(calib)
+            except ValueError:
+                self._remove_cached_calibration()
+                calib = None
+
+        # Otherwise read from flash, and only cache complete data that parsed successfully
+        if calib is None:
+            calib = self.read_calibration_file()
+            self._parse_calibration(calib)
+            if self._calibration_file_terminated:
+                self._save_cached_calibration(calib)
+        self._calibration_data_loaded = True
+
+    def _parse_calibration(self, calib):
+        """Parse the raw calibration file and set the calibration attributes, raising ValueError if malformed."""
+        # Parse straight from bytes, float() and np.fromstring accept ASCII bytes without decoding
+        calib = bytes(calib)
+
+        # Byte offsets of line starts; line i spans line_starts[i]:line_starts[i + 1]
+        newlines = np.flatnonzero(np.frombuffer(calib, dtype=np.uint8) == 0x0A)
+        line_starts = np.concatenate(([0], newlines + 1, [len(calib) + 1]))
 
         # Parse bck_aT from second line
         try:
-            self.bck_aT = float(lines[1])
+            self.bck_aT = float(calib[line_starts[1]:line_starts[2] - 1])
         except (ValueError, IndexError) as e:
             raise ValueError("Failed to parse bck_aT from calibration data") from e
 
-        # Parse calibration arrays and convert to float
-        self.wavelength = np.array(lines[12:3665], dtype=float)
-        self.norm_coef = np.array(lines[3666:7319], dtype=float)
-        self.power_coef = np.array(lines[7320:10973], dtype=float)
-        self._calibration_data_loaded = True
+        # Parse calibration arrays in one pass, each array is a view of the packed data
+        packed, slices = _parse_float_blocks(calib, line_starts, CALIBRATION_BLOCKS)
+        self.wavelength, self.norm_coef, self.power_coef = (
+            packed[start:stop] for start, stop in slices
+        )
+
+        # float32 reciprocal for the default fp32 path, turning the per-pixel divide into a multiply
+        self._inv_norm_coef = np.reciprocal(self.norm_coef.astype(np.float32))
+
+        # Normalization and power calibration fused into one coefficient per pixel
+        self._combined_coef = self.power_coef / (self.norm_coef * self.bck_aT)
+        self._combined_coef_f32 = self._combined_coef.astype(np.float32)
+        self._scaled_coef_f32 = None
     
     def set_parameters(self, num_of_scans=None, num_of_blank_scans=None, exposure_time=None,
                    scan_mode=None, num_of_start_element=None, num_of_end_element=None,
@@ -160,78 +347,237 @@ class ASQESpectrometer:
             self.reduction_mode = reduction_mode
 
     def configure_acquisition(self):
-        self.lib.setAcquisitionParameters(
-            ctypes.c_uint16(self.num_of_scans),
-            ctypes.c_uint16(self.num_of_blank_scans),
-            ctypes.c_uint8(self.scan_mode),
-            ctypes.c_uint32(self.exposure_time)
-        )
+        with self._device_lock:
+            self._check_open()
+            # argtypes are declared, so ctypes converts the Python ints directly
+            self.lib.setAcquisitionParameters(
+                self.num_of_scans,
+                self.num_of_blank_scans,
+                self.scan_mode,
+                self.exposure_time
+            )
 
-        num_pixels = ctypes.c_uint16(0)
-        self.lib.setFrameFormat(
-            ctypes.c_uint16(self.num_of_start_element),
-            ctypes.c_uint16(self.num_of_end_element),
-            ctypes.c_uint8(self.reduction_mode),
-            ctypes.byref(num_pixels)
-        )
+            self.lib.setFrameFormat(
+                self.num_of_start_element,
+                self.num_of_end_element,
+                self.reduction_mode,
+                ctypes.byref(self._num_pixels)
+            )
 
-    def capture_frame(self):
-        self.lib.triggerAcquisition()
+    def _acquire(self, buffer, timeout=None, stop=None):
+        """
+        Trigger an acquisition, wait for it and read the frame into the given ctypes buffer.
+        Returns False without triggering if the optional stop event is already set. Once triggered,
+        the frame is always read so no acquisition is left pending on the device.
+        """
+        with self._device_lock:
+            self._check_open()
+            if stop is not None and stop.is_set():
+                return False
+            self._trigger()
 
-        status = ctypes.c_uint8(0)
-        frames = ctypes.c_uint16(0)
-        while frames.value == 0:
-            sleep(0.025)
-            self.lib.getStatus(ctypes.byref(status), ctypes.byref(frames))
+            # Poll with exponential backoff from 100 us up to 25 ms
+            deadline = None if timeout is None else time.monotonic() + timeout
+            delay = 1e-4
+            status = ctypes.c_uint8(0)
+            frames = ctypes.c_uint16(0)
+            while True:
+                result = self._get_status(ctypes.byref(status), ctypes.byref(frames))
+                if result != 0:
+                    raise RuntimeError(f"getStatus failed with code {result}")
+                if frames.value != 0:
+                    break
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"No frame received within {timeout} s")
+                time.sleep(delay)
+                delay = min(delay * 2, 0.025)
 
-        buffer_size = 3694
-        buffer = (ctypes.c_uint16 * buffer_size)()
-        self.lib.getFrame(buffer, 65535)
+            self._get_frame(buffer, 65535)
+            return True
+
+    def capture_frame(self, timeout=None):
+        """
+        Trigger an acquisition and return the frame as a uint16 array.
+        The array is a view of a buffer reused by the next capture; copy it to keep it.
+        timeout: seconds to wait for the frame, None waits indefinitely.
+        """
+        self._acquire(self._frame_buf, timeout)
+        return self._frame_view
 
-        return buffer
+    def get_spectrum(self, timeout=None):
+        """
+        Capture a frame into a buffer owned by the caller and return it as a uint16 array.
+        Pass the array to release_frame() once done with it to reuse its buffer.
+        """
+        buffer = self._buf_pool.pop() if self._buf_pool else (ctypes.c_uint16 * FRAME_BUFFER_SIZE)()
+        try:
+            self._acquire(buffer, timeout)
+        except Exception:
+            self._buf_pool.append(buffer)
+            raise
+        return np.frombuffer(buffer, dtype=np.uint16)
 
-    def get_spectrum(self):
-        return self.capture_frame()
+    def release_frame(self, frame):
+        """Return a frame from get_spectrum() to the buffer pool. The frame must not be used afterwards."""
+        buffer = frame.base
+        if type(buffer) is not type(self._frame_buf) or buffer is self._frame_buf:
+            return
+        # A buffer released twice would otherwise back two live frames at once
+        if any(pooled is buffer for pooled in self._buf_pool):
+            return
+        self._buf_pool.append(buffer)
     
     def subtract_background(self):
         """
         1. get_spectrum()
         2. Subtract background average from both ends of the array. Keeps only elements from index 32 to 3685.
         """
-        data = self.capture_frame()
-        devd = np.mean(data[15:31])      # average of elements 15 to 31
-        devd2 = np.mean(data[3686:3692]) # average of elements 3686 to 3692
-        background = (devd + devd2) / 2
+        return self._subtract_background(self.capture_frame())
+
+    def _subtract_background(self, data, dtype=np.float32):
+        # Mean of the averages of elements 15 to 31 and 3686 to 3692, i.e. sum/16/2 + sum/6/2
+        bg_hi = np.add.reduce(data[15:31], dtype=np.uint32)
+        bg_lo = np.add.reduce(data[3686:3692], dtype=np.uint32)
+        background = bg_hi * (1.0 / 32) + bg_lo * (1.0 / 12)
 
         # Subtract background and slice
-        corrected = data[32:3685] - background
+        corrected = data[32:3685].astype(dtype) - dtype(background)
         return corrected
     
-    def normalize_spectrum(self):
+    def normalize_spectrum(self, precision='fp32'):
         """
         1. subtract_background()
         2. Apply narmalization to spectrum: Normalization: spectrum[i] /= norm_coef[i]
+        precision: 'fp32' (default) or 'fp64' for the returned spectrum.
         """
+        if precision not in ('fp32', 'fp64'):
+            raise ValueError(f"precision must be 'fp32' or 'fp64', got {precision!r}")
         if not self._calibration_data_loaded:
             self.load_calibration_data()
         
-        data = self.subtract_background()
-        # Convert to float for precision during calculations
-        data = data.astype(np.float64)
+        if precision == 'fp64':
+            data = self._subtract_background(self.capture_frame(), np.float64)
+            data /= self.norm_coef
+            return self.wavelength, data
 
         # Apply normalization coefficients
-        data /= self.norm_coef
+        data = self.subtract_background()
+        data *= self._inv_norm_coef
         return self.wavelength, data
     
-    def get_calibrated_spectrum(self):
+    def get_calibrated_spectrum(self, precision='fp32'):
         """
         Apply full calibration to spectrum:
-        1. normalize_spectrum()
-        2. power calibration: spectrum[i] *= power_coef[i] / ((exposure_time) * bck_aT)
+        1. subtract_background()
+        2. normalization: spectrum[i] /= norm_coef[i]
+        3. power calibration: spectrum[i] *= power_coef[i] / ((exposure_time) * bck_aT)
+        Steps 2 and 3 are applied as a single multiply by the precomputed combined coefficient.
+        precision: 'fp32' (default) or 'fp64' for the returned spectrum.
+
+        This path is memory-bound, not compute-bound: ~3 operations per pixel on 3653 pixels.
+        It is kept fast by fusing the passes (one cached float32 coefficient that already includes
+        1 / exposure_time), working in float32 and multiplying in place, or by the numba kernel.
+        Changes should target memory traffic and passes over the array; wider SIMD (AVX-512 etc.)
+        will not help here.
         """
-        wavelength, data = self.normalize_spectrum()
-        data *= self.power_coef / (self.exposure_time * self.bck_aT)
-        return wavelength, data
+        if precision not in ('fp32', 'fp64'):
+            raise ValueError(f"precision must be 'fp32' or 'fp64', got {precision!r}")
+        if not self._calibration_data_loaded:
+            self.load_calibration_data()
+
+        return self.wavelength, self._calibrate_frame(self.capture_frame(), precision)
+
+    def _get_scaled_coef(self):
+        """float32 combined coefficient divided by exposure_time, recomputed only when it changes."""
+        if self._scaled_coef_f32 is None or self._scaled_exposure_time != self.exposure_time:
+            self._scaled_coef_f32 = self._combined_coef_f32 * np.float32(1.0 / self.exposure_time)
+            self._scaled_exposure_time = self.exposure_time
+        return self._scaled_coef_f32
+
+    def _calibrate_frame(self, raw, precision):
+        """Background-subtract and calibrate a raw uint16 frame, returning a new array."""
+        if precision == 'fp32' and _calibrate is not None:
+            return _calibrate(raw, self._get_scaled_coef())
+
+        if precision == 'fp64':
+            data = self._subtract_background(raw, np.float64)
+            data *= self._combined_coef / self.exposure_time
+            return data
+
+        data = self._subtract_background(raw)
+        np.multiply(data, self._get_scaled_coef(), out=data)
+        return data
+
+    def stream_spectra(self, n, precision='fp32', timeout=None):
+        """
+        Yield n calibrated spectra as (wavelength, intensity) tuples.
+        A background thread acquires the next frame while the current one is calibrated,
+        using two frame buffers in turn. Device calls made inside the loop are serialized
+        with the thread, but they are interleaved between streamed frames.
+        """
+        if precision not in ('fp32', 'fp64'):
+            raise ValueError(f"precision must be 'fp32' or 'fp64', got {precision!r}")
+        if not self._calibration_data_loaded:
+            self.load_calibration_data()
+
+        free = queue.Queue()
+        filled = queue.Queue()
+        for _ in range(2):
+            free.put((ctypes.c_uint16 * FRAME_BUFFER_SIZE)())
+        stop = threading.Event()
+
+        def producer():
+            try:
+                for _ in range(n):
+                    buffer = free.get()
+                    if stop.is_set():
+                        return
+                    if not self._acquire(buffer, timeout, stop):
+                        return
+                    filled.put(buffer)
+            except Exception as e:
+                filled.put(e)
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            for _ in range(n):
+                buffer = filled.get()
+                if isinstance(buffer, Exception):
+                    raise buffer
+                data = self._calibrate_frame(np.frombuffer(buffer, dtype=np.uint16), precision)
+                free.put(buffer)
+                yield self.wavelength, data
+        finally:
+            # Unblock the producer if the caller stopped early. It stops before the next trigger, an
+            # acquisition in progress is still read out; the device lock makes later captures wait for it
+            stop.set()
+            free.put(None)
+            thread.join(timeout=1.0)
+
+    def close(self):
+        """Disconnect from the device. Safe to call more than once."""
+        if getattr(self, 'lib', None) is None:
+            return
+        with self._device_lock:
+            self.lib.disconnectDevice()
+            self.lib = None
+            # Drop the bound functions too, otherwise they would still call into the driver
+            self._trigger = None
+            self._get_status = None
+            self._get_frame = None
+            self._read_flash = None
+
+    def _check_open(self):
+        if self.lib is None:
+            raise ConnectionError("Device is closed")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def __del__(self):
-        self.lib.disconnectDevice()
+        # Safety net only; prefer close() or a with-block, __del__ may not run at interpreter shutdown
+        self.close()